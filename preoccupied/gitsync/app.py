@@ -6,21 +6,53 @@ FastAPI webhook application for the gitsync service.
 :ai-assistant: Auto via Cursor
 """
 
+import asyncio
 import logging
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+from typing import Optional
 
 from fastapi import FastAPI, Header, HTTPException
 
 from .config import get_config
+from .github import close_http_client
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def app_startup():
+async def _startup_sync(repo_name: str, repo, semaphore: asyncio.Semaphore) -> None:
     """
-    Startup event handler for the app
+    Sync a single repository on startup, logging rather than raising any
+    failure so that the remaining repositories still get synced.
+    """
+
+    async with semaphore:
+        try:
+            logger.info(f"Syncing repository '{repo_name}' on startup...")
+            await repo.sync()
+            logger.info(f"Successfully synced repository '{repo_name}'")
+        except Exception as e:
+            logger.error(f"Failed to sync repository '{repo_name}' on startup: {e}", exc_info=True)
+
+
+async def _startup_sync_all(config) -> None:
+    """
+    Sync all repositories on startup, concurrently but bounded so a large
+    config doesn't swamp the network or disk with simultaneous clones.
+    """
+
+    semaphore = asyncio.Semaphore(config.global_.max_parallel_syncs)
+    await asyncio.gather(*(
+        _startup_sync(repo_name, repo, semaphore)
+        for repo_name, repo in config.repos.items()))
+
+
+async def app_startup() -> Optional[asyncio.Task]:
+    """
+    Startup event handler for the app. Loads the configuration, raising if
+    that fails, and then starts syncing all repositories in a background
+    task, which is returned. Returns None if sync_on_startup is disabled.
     """
 
     # fetch configuration for the first time
@@ -32,15 +64,9 @@ async def app_startup():
 
     # pre-sync all repositories
     if not config.global_.sync_on_startup:
-        return
+        return None
 
-    for repo_name, repo in config.repos.items():
-        try:
-            logger.info(f"Syncing repository '{repo_name}' on startup...")
-            await repo.sync()
-            logger.info(f"Successfully synced repository '{repo_name}'")
-        except Exception as e:
-            logger.error(f"Failed to sync repository '{repo_name}' on startup: {e}", exc_info=True)
+    return asyncio.create_task(_startup_sync_all(config))
 
 
 @asynccontextmanager
@@ -51,13 +77,20 @@ async def app_lifespan(app: FastAPI):
 
     logger.info('Starting up...')
 
-    await app_startup()
+    # the startup sync runs in the background, so that the app can begin
+    # serving requests without waiting for every repository to sync
+    startup = await app_startup()
 
     try:
         yield
     finally:
 
         logger.info('Shutting down...')
+        if startup is not None:
+            startup.cancel()
+            with suppress(asyncio.CancelledError):
+                await startup
+        await close_http_client()
 
 
 app = FastAPI(lifespan=app_lifespan)
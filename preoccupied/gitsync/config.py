@@ -6,14 +6,20 @@ Configuration models and loading for the gitsync application.
 :ai-assistant: Auto via Cursor
 """
 
+import hashlib
+import json
 import logging
 import os
-from typing import Annotated, Any, Dict, Literal, Optional, Union
+import tempfile
+import threading
+import zlib
+from subprocess import CalledProcessError
+from typing import Annotated, Any, Dict, Literal, Optional, Tuple, Union
 
 import yaml
 from pydantic import BaseModel, Field, model_validator
 
-from .github import github_installation_token
+from .github import github_installation_token, invalidate_token
 from .gitsync import sync_git_repo
 
 
@@ -23,7 +29,44 @@ logger = logging.getLogger(__name__)
 CONFIG_PATH = os.environ.get('GITSYNC_CONFIG_PATH', '/etc/gitsync.yml')
 
 
+# prefer the libyaml-backed loader when PyYAML was built with it
+_YamlLoader = yaml.CSafeLoader if hasattr(yaml, 'CSafeLoader') else yaml.SafeLoader
+
+
+# git's stderr when the remote rejected the credentials it was given
+_GIT_AUTH_ERRORS = (
+    b'Authentication failed',
+    b'could not read Username',
+    b'could not read Password',
+    b'HTTP 401',
+    b'HTTP 403',
+    b'The requested URL returned error: 401',
+    b'The requested URL returned error: 403',
+)
+
+
 _config: Optional['RootConfig'] = None
+_config_mtime: Optional[float] = None
+_config_lock = threading.Lock()
+
+
+def _git_auth_failed(e: CalledProcessError) -> bool:
+    """
+    Whether a failed git command was refused for its credentials.
+    """
+
+    stderr = e.stderr or b''
+    if isinstance(stderr, str):
+        stderr = stderr.encode()
+    return any(msg in stderr for msg in _GIT_AUTH_ERRORS)
+
+
+def _default_git_jobs() -> int:
+    """
+    Default number of parallel git jobs, one per CPU but no more than 8.
+    """
+
+    return min(os.cpu_count() or 1, 8)
 
 
 class GlobalConfig(BaseModel):
@@ -33,10 +76,15 @@ class GlobalConfig(BaseModel):
 
     github_app_id: Optional[str] = None
     github_installation_id: Optional[str] = None
+    github_installation_ids: Tuple[str, ...] = ()
     github_keyfile: Optional[str] = None
 
     webhook_secret: Optional[str] = None
     sync_on_startup: bool = True
+    max_parallel_syncs: int = Field(default=8, ge=1)
+    git_jobs: int = Field(default_factory=_default_git_jobs, ge=1)
+
+    model_config = {'frozen': True}
 
 
 class RepoConfig(BaseModel):
@@ -50,6 +98,13 @@ class RepoConfig(BaseModel):
     branch: str = 'master'
     webhook_secret: Optional[str] = None
     provider: Literal['git'] = 'git'
+    git_jobs: int = Field(default_factory=_default_git_jobs, ge=1)
+    shallow: bool = True
+    depth: int = Field(default=1, ge=1)
+    filter: Optional[str] = None
+
+    # repo configs are replaced wholesale on reload, never modified
+    model_config = {'frozen': True, 'extra': 'ignore', 'populate_by_name': True}
 
 
     async def sync(self) -> None:
@@ -61,6 +116,9 @@ class RepoConfig(BaseModel):
             repo_dir=self.directory,
             git_url=self.git_url,
             git_branch=self.branch,
+            git_jobs=self.git_jobs,
+            git_depth=self.depth if self.shallow else None,
+            git_filter=self.filter,
         )
 
 
@@ -72,9 +130,25 @@ class GitHubRepoConfig(RepoConfig):
     provider: Literal['github']
     github_app_id: Optional[str] = None
     github_installation_id: Optional[str] = None
+    github_installation_ids: Tuple[str, ...] = ()
     github_keyfile: Optional[str] = None
 
 
+    def pick_installation_id(self) -> Optional[str]:
+        """
+        The installation ID to mint tokens with. This is github_installation_id
+        if set, otherwise one from the github_installation_ids pool, chosen by
+        a stable hash of the repo name so that each repo keeps reusing the
+        same installation's token.
+        """
+
+        if self.github_installation_id or not self.github_installation_ids:
+            return self.github_installation_id
+
+        ids = self.github_installation_ids
+        return ids[zlib.crc32(self.name.encode()) % len(ids)]
+
+
     async def github_installation_token(self) -> Optional[str]:
         """
         Get a GitHub installation token for the given repository.
@@ -86,7 +160,7 @@ class GitHubRepoConfig(RepoConfig):
         return await github_installation_token(
             github_keyfile=self.github_keyfile,
             github_app_id=self.github_app_id,
-            github_installation_id=self.github_installation_id
+            github_installation_id=self.pick_installation_id()
         )
 
 
@@ -95,12 +169,24 @@ class GitHubRepoConfig(RepoConfig):
         Sync the repository.
         """
 
-        return await sync_git_repo(
-            repo_dir=self.directory,
-            git_url=self.git_url,
-            git_branch=self.branch,
-            git_token=await self.github_installation_token()
-        )
+        git_token = await self.github_installation_token()
+
+        try:
+            return await sync_git_repo(
+                repo_dir=self.directory,
+                git_url=self.git_url,
+                git_branch=self.branch,
+                git_jobs=self.git_jobs,
+                git_depth=self.depth if self.shallow else None,
+                git_filter=self.filter,
+                git_token=git_token
+            )
+        except CalledProcessError as e:
+            # the token may have been revoked, so don't keep reusing it,
+            # but other failures are no reason to mint a new one
+            if git_token and _git_auth_failed(e):
+                invalidate_token(self.github_app_id, self.pick_installation_id())
+            raise
 
 
 RepoTypes = Union[RepoConfig, GitHubRepoConfig]
@@ -116,67 +202,90 @@ class RootConfig(BaseModel):
         default_factory=dict
     )
 
-    model_config = {'populate_by_name': True}
+    # like the repos, the whole config is replaced on reload
+    model_config = {'frozen': True, 'populate_by_name': True}
 
 
     @model_validator(mode='before')
     def apply_global_defaults(cls, v: Dict[str, Any]) -> Dict[str, Any]:
         """
         Apply global config defaults to repos that don't have them set.
+        Repo dicts are updated in place rather than copied.
         """
 
         fixed = {}
-        glbl = fixed['global'] = GlobalConfig.model_validate(v.get('global', {}))
+        glbl = fixed['global'] = GlobalConfig.model_validate(v.get('global', v.get('global_', {})))
+
+        defaults = (
+            ('webhook_secret', glbl.webhook_secret),
+            ('git_jobs', glbl.git_jobs),
+        )
+        github_defaults = defaults + (
+            ('github_keyfile', glbl.github_keyfile),
+            ('github_app_id', glbl.github_app_id),
+            ('github_installation_id', glbl.github_installation_id),
+            ('github_installation_ids', glbl.github_installation_ids),
+        )
 
         repos = fixed['repos'] = v.get('repos', {})
         for repo_name, repo in repos.items():
             if isinstance(repo, dict):
-                repo = repos[repo_name] = repo.copy()
                 repo.setdefault('name', repo_name)
                 provider = repo.setdefault('provider', 'git')
 
-                if provider == 'github':
-                    repo.setdefault('github_keyfile', glbl.github_keyfile)
-                    repo.setdefault('github_app_id', glbl.github_app_id)
-                    repo.setdefault('github_installation_id', glbl.github_installation_id)
-
-                repo.setdefault('webhook_secret', glbl.webhook_secret)
+                for key, value in (github_defaults if provider == 'github' else defaults):
+                    if value is not None and key not in repo:
+                        repo[key] = value
 
         return fixed
 
 
+# For ENV configuration, these are considered global settings, and they'll
+# apply to the ENV repository if configured, and will be the baseline for any
+# value loaded in the config file (if any)
+_ENV_GLOBAL = {
+    'GITSYNC_GITHUB_APP_ID': 'github_app_id',
+    'GITSYNC_GITHUB_INSTALLATION_ID': 'github_installation_id',
+    'GITSYNC_GITHUB_KEYFILE': 'github_keyfile',
+    'GITSYNC_WEBHOOK_SECRET': 'webhook_secret',
+}
+
+_ENV_REPO = {
+    'GITSYNC_REPO_NAME': 'name',
+    'GITSYNC_REPO_DIRECTORY': 'directory',
+    'GITSYNC_REPO_GIT_URL': 'git_url',
+    'GITSYNC_REPO_BRANCH': 'branch',
+    'GITSYNC_REPO_PROVIDER': 'provider',
+}
+
+# GITSYNC_* variables that are read elsewhere, rather than by _config_from_env
+_ENV_OTHER = frozenset((
+    'GITSYNC_CONFIG_PATH',
+    'GITSYNC_GITHUB_HOST',
+    'GITSYNC_TOKEN_CACHE_DIR',
+))
+
+
 def _config_from_env() -> Dict[str, Any]:
     """
     Build configuration dictionary from GITSYNC_* environment variables.
+    Unrecognized GITSYNC_* variables are logged as warnings, since they're
+    most likely misspellings.
     """
 
-    # For ENV configuration, these three are considered global settings, and
-    # they'll apply to the ENV repository if configured, and will be the baseline
-    # for any value loaded in the config file (if any)
     global_config = {}
-    pairs = (
-        ('GITSYNC_GITHUB_APP_ID', 'github_app_id'),
-        ('GITSYNC_GITHUB_INSTALLATION_ID', 'github_installation_id'),
-        ('GITSYNC_GITHUB_KEYFILE', 'github_keyfile'),
-        ('GITSYNC_WEBHOOK_SECRET', 'webhook_secret'))
-
-    for env_var, config_key in pairs:
-        value = os.environ.get(env_var)
-        if value is not None:
-            global_config[config_key] = value
-
     repo_config = {}
-    pairs = (
-        ('GITSYNC_REPO_NAME', 'name'),
-        ('GITSYNC_REPO_DIRECTORY', 'directory'),
-        ('GITSYNC_REPO_GIT_URL', 'git_url'),
-        ('GITSYNC_REPO_BRANCH', 'branch'),
-        ('GITSYNC_REPO_PROVIDER', 'provider'))
-
-    for env_var, config_key in pairs:
-        value = os.environ.get(env_var)
-        if value is not None:
-            repo_config[config_key] = value
+
+    # a single pass over the environment, rather than a lookup per setting
+    for key, value in os.environ.items():
+        if not key.startswith('GITSYNC_'):
+            continue
+        if key in _ENV_GLOBAL:
+            global_config[_ENV_GLOBAL[key]] = value
+        elif key in _ENV_REPO:
+            repo_config[_ENV_REPO[key]] = value
+        elif key not in _ENV_OTHER:
+            logger.warning(f'Ignoring unknown environment variable {key}')
 
     if repo_config:
         repo_config.setdefault('name', 'default')
@@ -189,35 +298,160 @@ def _config_from_env() -> Dict[str, Any]:
     return result
 
 
-def get_config():
+def _config_mtime_of(path: Optional[str]) -> Optional[float]:
     """
-    Get the global config object.
+    Modification time of the config file at path, or None if there is no
+    such file.
     """
 
-    global _config
+    if not path:
+        return None
 
-    if _config is None:
-        env_config = _config_from_env()
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
 
-        if CONFIG_PATH and os.path.exists(CONFIG_PATH):
-            # TODO: reload config file if it changes, but only if the config
-            # file is newer than the last reload
 
-            logger.info(f'Loading configuration from {CONFIG_PATH}')
+def _config_cache_path() -> str:
+    """
+    Path of the JSON sidecar cache for the config file.
+    """
 
-            with open(CONFIG_PATH, 'r') as f:
-                config_data = yaml.safe_load(f)
-            config_data.setdefault('global', {}).update(env_config.get('global', {}))
-            config_data.setdefault('repos', {}).update(env_config.get('repos', {}))
-        else:
+    return f'{CONFIG_PATH}.cache.json'
+
+
+def _read_config_cache(digest: str, env_config: Dict[str, Any]) -> Optional['RootConfig']:
+    """
+    Load the RootConfig from the JSON sidecar cache, if that cache was
+    written from config file contents with the same SHA-256 digest and with
+    the same environment overrides. Returns None when the cache is missing,
+    stale, or unreadable.
+    """
 
-            logger.info(f'Loading configuration from environment variables')
-            config_data = env_config
+    try:
+        with open(_config_cache_path(), 'rb') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
 
-        _config = RootConfig.model_validate(config_data)
-        logger.info(f'Loaded configuration with {len(_config.repos)} repositories')
+    if not isinstance(cached, dict):
+        return None
+
+    if cached.get('sha256') != digest or cached.get('env') != env_config:
+        return None
+
+    try:
+        return RootConfig.model_validate(cached['config'])
+    except Exception as e:
+        logger.warning(f'Ignoring invalid config cache {_config_cache_path()}: {e}')
+        return None
+
+
+def _write_config_cache(config: 'RootConfig', digest: str, env_config: Dict[str, Any]) -> None:
+    """
+    Atomically write the JSON sidecar cache for the config file. The cache
+    holds secrets, so it is only readable by the owner. Failure to write
+    (eg. a read-only config directory) is not an error.
+    """
+
+    cache_path = _config_cache_path()
+    cached = {
+        'sha256': digest,
+        'env': env_config,
+        'config': config.model_dump(mode='json', by_alias=True),
+    }
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path) or '.',
+            prefix='.gitsync-config-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.debug(f'Unable to write config cache {cache_path}: {e}')
+
+
+def _load_config(mtime: Optional[float]) -> 'RootConfig':
+    """
+    Build a RootConfig from the environment, merged over the config file
+    if one was found (as indicated by a non-None mtime). A JSON sidecar
+    cache of the merged result is used in place of parsing the config file
+    when it was written from identical file contents.
+    """
+
+    env_config = _config_from_env()
+
+    if mtime is not None:
+        # the contents are hashed rather than trusting the mtime, which
+        # copies and archive extraction can carry over unchanged
+        with open(CONFIG_PATH, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        config = _read_config_cache(digest, env_config)
+        if config is not None:
+            logger.info(f'Loaded configuration from cache {_config_cache_path()}')
+            return config
+
+        logger.info(f'Loading configuration from {CONFIG_PATH}')
+
+        # an empty document loads as None
+        config_data = yaml.load(raw, Loader=_YamlLoader) or {}
+        config_data.setdefault('global', {}).update(env_config.get('global', {}))
+        # the env repo is copied as validation fills in its defaults, and
+        # env_config must stay as-is to be compared against the cache
+        config_data.setdefault('repos', {}).update(
+            (name, dict(repo)) for name, repo in env_config.get('repos', {}).items())
+
+        config = RootConfig.model_validate(config_data)
+        _write_config_cache(config, digest, env_config)
+
+    else:
+        logger.info(f'Loading configuration from environment variables')
+        config = RootConfig.model_validate(env_config)
+
+    logger.info(f'Loaded configuration with {len(config.repos)} repositories')
+
+    return config
+
+
+def get_config():
+    """
+    Get the global config object. The config file is only re-read when its
+    modification time changes, otherwise the cached config is returned.
+
+    If re-reading a changed config file fails, the error is logged and the
+    last good config remains in use until the file changes again. Only the
+    initial load raises.
+    """
 
-    return _config
+    global _config, _config_mtime
+
+    mtime = _config_mtime_of(CONFIG_PATH)
+    if _config is not None and mtime == _config_mtime:
+        return _config
+
+    with _config_lock:
+        # another thread may have reloaded while we waited on the lock
+        if _config is None or mtime != _config_mtime:
+            try:
+                config = _load_config(mtime)
+            except Exception as e:
+                if _config is None:
+                    raise
+                logger.error(f'Failed to reload configuration, keeping the previous one: {e}',
+                             exc_info=True)
+            else:
+                _config = config
+            _config_mtime = mtime
+
+        return _config
 
 
 def get_repo_config(repo_name: str) -> Optional[Union[RepoConfig, GitHubRepoConfig]]:
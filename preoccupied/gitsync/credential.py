@@ -0,0 +1,103 @@
+"""
+A git credential helper that answers with GitHub App installation
+tokens, for use outside of the gitsync service, eg.
+
+  git -c credential.helper=gitsync-credential-helper clone ...
+
+The app ID, installation ID, and private key file are taken from the
+same GITSYNC_GITHUB_* environment variables that the service reads.
+Tokens are shared with the service through the on-disk token cache, so
+repeated invocations only mint a new token when the cached one is near
+expiry. Credentials are only given to GitHub itself, or to the host
+named by GITSYNC_GITHUB_HOST.
+
+:author: Christopher O'Brien <obriencj@preoccupied.net>
+:license: GNU General Public License v3
+:ai-assistant: Auto via Cursor
+"""
+
+import asyncio
+import os
+import sys
+from typing import Dict, List, Optional, TextIO
+
+from .github import close_http_client, github_installation_token, invalidate_token
+
+
+DEFAULT_HOST = 'github.com'
+
+
+def read_request(stream: TextIO) -> Dict[str, str]:
+    """
+    Read a git credential request of key=value lines, terminated by a
+    blank line or end of input.
+    """
+
+    request = {}
+    for line in stream:
+        line = line.rstrip('\n')
+        if not line:
+            break
+        key, _, value = line.partition('=')
+        request[key] = value
+    return request
+
+
+async def _token() -> str:
+    """
+    The installation token for the environment's GitHub App settings.
+    """
+
+    try:
+        return await github_installation_token(
+            github_keyfile=os.environ.get('GITSYNC_GITHUB_KEYFILE'),
+            github_app_id=os.environ.get('GITSYNC_GITHUB_APP_ID'),
+            github_installation_id=os.environ.get('GITSYNC_GITHUB_INSTALLATION_ID'),
+        )
+    finally:
+        await close_http_client()
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """
+    Entry point for gitsync-credential-helper. Only https requests for
+    the GitHub host are answered. 'get' produces credentials, 'erase'
+    discards the cached token that git found to be rejected, and
+    'store' is accepted and ignored.
+    """
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if args not in (['get'], ['erase']):
+        return 0
+
+    request = read_request(sys.stdin)
+    if request.get('protocol') != 'https':
+        return 0
+
+    if request.get('host') != os.environ.get('GITSYNC_GITHUB_HOST', DEFAULT_HOST):
+        return 0
+
+    if args == ['erase']:
+        app_id = os.environ.get('GITSYNC_GITHUB_APP_ID')
+        installation_id = os.environ.get('GITSYNC_GITHUB_INSTALLATION_ID')
+        if app_id and installation_id:
+            invalidate_token(app_id, installation_id)
+        return 0
+
+    try:
+        token = asyncio.run(_token())
+    except Exception as e:
+        print(f"gitsync-credential-helper: {e}", file=sys.stderr)
+        return 1
+
+    sys.stdout.write(f'username=x-access-token\npassword={token}\n\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# The end.
@@ -7,84 +7,242 @@ GitHub-specific token logic for the gitsync application.
 """
 
 import asyncio
+import json
+import os
+import tempfile
 import time
 from datetime import datetime, timezone
-from typing import Union, Dict, Tuple
+from typing import Any, Union, Dict, Optional, Tuple
 
 import httpx
 import jwt
 import logging
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 
 logger = logging.getLogger(__name__)
 
 
-CACHE_THRESHOLD = 50 * 60  # 50 minutes
+# Cached tokens are refreshed once they're within this long of expiring
+CACHE_THRESHOLD = 10 * 60  # 10 minutes
+
+# App JWTs are valid for 10 minutes, and are reused for up to 8 of those
+JWT_REUSE = 8 * 60
+
+# Media type requested from the GitHub REST API
+GITHUB_ACCEPT = 'application/vnd.github+json'
+
+# Minted tokens are also saved here, so they survive a process restart
+TOKEN_CACHE_DIR = os.environ.get('GITSYNC_TOKEN_CACHE_DIR', tempfile.gettempdir())
 
 
 # Cache for GitHub installation tokens, keyed by (app_id, installation_id)
 _token_cache: Dict[Tuple[str, str], Dict[str, Union[str, datetime]]] = {}
 _cache_lock = asyncio.Lock()
 
+# Per-key locks, so concurrent requests for the same token mint it only once
+_key_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
 
-async def github_installation_token(
-        github_keyfile: str,
+# Parsed private keys, keyed by keyfile path
+_key_cache: Dict[str, Any] = {}
+
+# Signed app JWTs and the time until which they may be reused, keyed by
+# (keyfile, app_id)
+_jwt_cache: Dict[Tuple[str, str], Tuple[str, float]] = {}
+
+# Shared HTTP client, so connections to the GitHub API are kept alive
+_http: Optional[httpx.AsyncClient] = None
+
+
+def _token_file(github_app_id: str, github_installation_id: str) -> str:
+    """
+    Path of the on-disk cache file for the given app ID and installation ID.
+    """
+
+    return os.path.join(TOKEN_CACHE_DIR, f'gitsync-token-{github_app_id}-{github_installation_id}.json')
+
+
+def _read_token_file(
         github_app_id: str,
-        github_installation_id: str) -> str:
+        github_installation_id: str) -> Optional[Dict[str, Union[str, datetime]]]:
+    """
+    Load a previously minted token from the on-disk cache. Returns None if
+    there is no cached token, or if the file isn't private to this user.
     """
-    Get a GitHub installation token for the given app ID and installation ID
-    using the private key in github_keyfile. Returns the installation token as a
-    string.
 
-    Tokens are cached and reused until they approach the end of their lifetime
-    (50 minutes, see CACHE_THRESHOLD), at which point a new token is requested.
+    try:
+        with open(_token_file(github_app_id, github_installation_id), 'r') as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                logger.warning(f'Ignoring token cache file {f.name} with unsafe ownership or permissions')
+                return None
+            data = json.load(f)
+
+        return {
+            'token': data['token'],
+            'expires_at': datetime.fromisoformat(data['expires_at']),
+        }
+
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.debug(f'Unable to read token cache for {github_app_id} / {github_installation_id}: {e}')
+        return None
+
+
+def _write_token_file(
+        github_app_id: str,
+        github_installation_id: str,
+        cached: Dict[str, Union[str, datetime]]) -> None:
+    """
+    Atomically save a minted token to the on-disk cache, readable only by
+    this user. Failure to write is logged and otherwise ignored.
     """
 
-    if not (github_app_id and github_installation_id and github_keyfile):
-        raise ValueError('github_app_id, github_installation_id, and github_keyfile must be set')
+    data = {
+        'token': cached['token'],
+        'expires_at': cached['expires_at'].isoformat(),
+    }
 
-    cache_key = (github_app_id, github_installation_id)
-    now = datetime.now(timezone.utc)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=TOKEN_CACHE_DIR, prefix='.gitsync-token-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, _token_file(github_app_id, github_installation_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.debug(f'Unable to write token cache for {github_app_id} / {github_installation_id}: {e}')
+
+
+async def _http_client() -> httpx.AsyncClient:
+    """
+    Get the shared HTTP client, creating it on first use.
+    """
+
+    global _http
 
-    # Check cache first
     async with _cache_lock:
-        if cache_key in _token_cache:
-            cached = _token_cache[cache_key]
-            expires_at = cached['expires_at']
-            # Check if token is still valid (hasn't reached 75% of lifetime)
-            # Tokens expire after 60 minutes, so 75% = 45 minutes remaining
-            threshold = expires_at.timestamp() - CACHE_THRESHOLD
-            if now.timestamp() < threshold:
-                logger.debug(f'Using cached token for {github_app_id} / {github_installation_id}')
-                return cached['token']
-
-            # Token is near expiry, remove from cache
-            logger.debug(f'Token for {github_app_id} / {github_installation_id} is near expiry, removing from cache')
-            del _token_cache[cache_key]
-
-    # Cache miss or token expired, request new token
-    with open(github_keyfile, 'r') as fk:
-        private_key = fk.read()
+        if _http is None:
+            _http = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_keepalive_connections=20))
+        return _http
+
+
+async def close_http_client() -> None:
+    """
+    Close the shared HTTP client, if it was ever created.
+    """
+
+    global _http
+
+    if _http is not None:
+        client, _http = _http, None
+        await client.aclose()
+
+
+def _private_key(github_keyfile: str) -> Any:
+    """
+    Load and parse the private key in github_keyfile, caching the result.
+    The cached key is dropped if GitHub rejects a JWT signed with it.
+    """
+
+    key = _key_cache.get(github_keyfile)
+    if key is None:
+        with open(github_keyfile, 'rb') as fk:
+            key = load_pem_private_key(fk.read(), password=None)
+        _key_cache[github_keyfile] = key
+
+    return key
+
+
+def _app_jwt(github_keyfile: str, github_app_id: str) -> str:
+    """
+    Get a signed JWT authenticating as the given GitHub app. A JWT is
+    reused for JWT_REUSE seconds, so a burst of token mints for the same
+    app only signs once.
+    """
+
+    now = int(time.time())
+
+    jwt_key = (github_keyfile, github_app_id)
+    cached = _jwt_cache.get(jwt_key)
+    if cached is not None and now < cached[1]:
+        return cached[0]
 
     payload = {
-        'iat': int(time.time()) - 60,
-        'exp': int(time.time()) + (10 * 60),
+        'iat': now - 60,
+        'exp': now + (10 * 60),
         'iss': github_app_id,
     }
 
-    jwt_token = jwt.encode(payload, private_key, algorithm='RS256')
+    jwt_token = jwt.encode(payload, _private_key(github_keyfile), algorithm='RS256')
+    _jwt_cache[jwt_key] = (jwt_token, now + JWT_REUSE)
+
+    return jwt_token
+
+
+def _cached_token(github_app_id: str, github_installation_id: str) -> Optional[str]:
+    """
+    Return the cached token for the given app ID and installation ID, if
+    there is one and it is not near expiry.
+    """
+
+    cache_key = (github_app_id, github_installation_id)
+    now = datetime.now(timezone.utc)
+
+    cached = _token_cache.get(cache_key)
+    if cached is None:
+        # nothing in memory, but a previous process may have saved one
+        cached = _read_token_file(github_app_id, github_installation_id)
+        if cached is not None:
+            _token_cache[cache_key] = cached
+
+    if cached is not None:
+        expires_at = cached['expires_at']
+        # Tokens expire after 60 minutes, and are reused until they have
+        # less than CACHE_THRESHOLD remaining
+        threshold = expires_at.timestamp() - CACHE_THRESHOLD
+        if now.timestamp() < threshold:
+            logger.debug(f'Using cached token for {github_app_id} / {github_installation_id}')
+            return cached['token']
+
+        # Token is near expiry, remove from cache
+        logger.debug(f'Token for {github_app_id} / {github_installation_id} is near expiry, removing from cache')
+        del _token_cache[cache_key]
+
+    return None
+
+
+async def _mint_token(
+        github_keyfile: str,
+        github_app_id: str,
+        github_installation_id: str) -> str:
+    """
+    Request a new installation token from GitHub and store it in the cache.
+    """
+
+    jwt_token = _app_jwt(github_keyfile, github_app_id)
     headers = {
         'Authorization': f'Bearer {jwt_token}',
-        'Accept': 'application/vnd.github+json'
+        'Accept': GITHUB_ACCEPT,
     }
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f'https://api.github.com/app/installations/{github_installation_id}/access_tokens',
-            headers=headers,
-        )
-        r.raise_for_status()
-        response_data = r.json()
+    client = await _http_client()
+    r = await client.post(
+        f'https://api.github.com/app/installations/{github_installation_id}/access_tokens',
+        headers=headers,
+    )
+    if r.status_code == 401:
+        # the app JWT was rejected, perhaps because the key was rotated, so
+        # read the keyfile afresh next time
+        _key_cache.pop(github_keyfile, None)
+        _jwt_cache.pop((github_keyfile, github_app_id), None)
+    r.raise_for_status()
+    response_data = r.json()
 
     token = response_data['token']
     expires_at_str = response_data['expires_at']
@@ -93,14 +251,67 @@ async def github_installation_token(
     expires_at = datetime.fromisoformat(expires_at_str.replace('Z', '+00:00'))
 
     # Store in cache
-    async with _cache_lock:
-        _token_cache[cache_key] = {
-            'token': token,
-            'expires_at': expires_at,
-        }
+    cached = {
+        'token': token,
+        'expires_at': expires_at,
+    }
+    _token_cache[(github_app_id, github_installation_id)] = cached
+    _write_token_file(github_app_id, github_installation_id, cached)
 
     logger.debug(f'New token for {github_app_id} / {github_installation_id} expires at {expires_at}')
     return token
 
 
+def invalidate_token(github_app_id: str, github_installation_id: str) -> None:
+    """
+    Discard any cached token for the given app ID and installation ID, in
+    memory and on disk, so that the next request mints a new one. For use
+    when a cached token was rejected.
+    """
+
+    _token_cache.pop((github_app_id, github_installation_id), None)
+
+    try:
+        os.unlink(_token_file(github_app_id, github_installation_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.debug(f'Unable to remove token cache for {github_app_id} / {github_installation_id}: {e}')
+
+
+async def github_installation_token(
+        github_keyfile: str,
+        github_app_id: str,
+        github_installation_id: str) -> str:
+    """
+    Get a GitHub installation token for the given app ID and installation ID
+    using the private key in github_keyfile. Returns the installation token as a
+    string.
+
+    Tokens are cached and reused until they approach the end of their lifetime
+    (10 minutes before expiry, see CACHE_THRESHOLD), at which point a new
+    token is requested.
+    The cache is kept both in memory and on disk under TOKEN_CACHE_DIR.
+    """
+
+    if not (github_app_id and github_installation_id and github_keyfile):
+        raise ValueError('github_app_id, github_installation_id, and github_keyfile must be set')
+
+    cache_key = (github_app_id, github_installation_id)
+
+    async with _cache_lock:
+        key_lock = _key_locks.get(cache_key)
+        if key_lock is None:
+            key_lock = _key_locks[cache_key] = asyncio.Lock()
+
+    # Only the first caller for a key mints a token. Any others waiting on
+    # the lock find that token in the cache once they acquire it.
+    async with key_lock:
+        token = _cached_token(github_app_id, github_installation_id)
+        if token is None:
+            token = await _mint_token(github_keyfile, github_app_id, github_installation_id)
+
+    return token
+
+
 # The end.
@@ -7,59 +7,149 @@ General git utilities for the gitsync application.
 """
 
 import asyncio
+import base64
 import logging
 import os
+import shutil
 import subprocess
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
+from urllib.parse import urlsplit
 
 
 logger = logging.getLogger(__name__)
 
 
-async def run(*args: str, cwd: str = None) -> None:
-    logger.debug(f'Running {args} in {cwd}')
+# Serializes syncs of the same repo directory
+_repo_locks: Dict[str, asyncio.Lock] = {}
+
+# Resolved paths of the commands run, keyed by command name
+_executables: Dict[str, str] = {}
+
+
+def _executable(name: str) -> str:
+    """
+    The full path to the named command, looked up on PATH once and then
+    remembered. Falls back to the bare name if it can't be found.
+    """
+
+    path = _executables.get(name)
+    if path is None:
+        path = _executables[name] = shutil.which(name) or name
+    return path
+
+
+async def run(
+        *args: str,
+        capture_output: bool = False,
+        env: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+    """
+    Run a command asynchronously, raising CalledProcessError if it exits
+    non-zero. Stdout is discarded unless capture_output is set, in which
+    case it is returned. Stderr is drained while waiting so that a chatty
+    command can't block on a full pipe. If given, env replaces the
+    environment of the command.
+    """
+
+    logger.debug(f'Running {args}')
+
+    # With a full executable path and close_fds off, subprocess can start
+    # the command with posix_spawn rather than fork, which avoids copying
+    # this process's page tables for every git run. Python opens its file
+    # descriptors non-inheritable, so nothing leaks into the child.
     process = await asyncio.create_subprocess_exec(
         *args,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
+        executable=_executable(args[0]),
+        close_fds=False,
+        env=env,
+        stdout=asyncio.subprocess.PIPE if capture_output else asyncio.subprocess.DEVNULL,
         stderr=asyncio.subprocess.PIPE
     )
-    returncode = await process.wait()
-    if returncode != 0:
-        stderr = await process.stderr.read()
-        raise subprocess.CalledProcessError(returncode, args, stderr=stderr)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, stderr=stderr)
+    return stdout
+
+
+def git_auth_env(git_url: str, git_token: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    An environment for git commands that authenticates to the host of
+    git_url with git_token, or None if no token applies. The token is sent
+    as an http.extraheader set through GIT_CONFIG_* variables, so it never
+    shows up in argv or in the repository's config, and the header is
+    scoped to git_url's host so that submodules elsewhere don't receive it.
+    """
+
+    if not (git_token and git_url.startswith('https://')):
+        return None
+
+    url = urlsplit(git_url)
+    basic = base64.b64encode(f'x-access-token:{git_token}'.encode()).decode()
+
+    env = dict(os.environ)
+    count = int(env.get('GIT_CONFIG_COUNT', 0))
+    env['GIT_CONFIG_COUNT'] = str(count + 1)
+    env[f'GIT_CONFIG_KEY_{count}'] = f'http.https://{url.netloc}/.extraheader'
+    env[f'GIT_CONFIG_VALUE_{count}'] = f'Authorization: Basic {basic}'
+    return env
 
 
 async def sync_git_repo(
         repo_dir: str,
         git_url: str,
         git_branch: str,
-        git_token: Optional[str] = None) -> None:
+        git_token: Optional[str] = None,
+        git_jobs: int = 1,
+        git_depth: Optional[int] = None,
+        git_filter: Optional[str] = None) -> None:
     """
     Initial or update the sync of the repository specified by repo_name.
+    Submodules are fetched git_jobs at a time. Only git_branch is cloned,
+    and if git_depth is set the history is truncated to that many commits.
+    If git_filter is set the clone is a partial clone using that object
+    filter, eg. 'blob:none', and omitted objects are fetched on demand.
     """
 
-    original_url = git_url
-    if git_token:
-        git_url = git_url.replace('https://', f'https://x-access-token:{git_token}@')
-
-    repo_path = Path(repo_dir)
-    git_dir = repo_path / '.git'
-
-    if not repo_path.exists() or not git_dir.exists():
-        logging.info(f'Cloning {original_url} to {repo_dir}')
-        repo_path.mkdir(parents=True, exist_ok=True)
-        os.makedirs(repo_dir, exist_ok=True)
-        await run('git', 'clone', git_url, repo_dir)
-    else:
-        logging.info(f'Pulling {original_url} to {repo_dir}')
-        if git_token:
-            await run('git', 'remote', 'set-url', 'origin', git_url, cwd=repo_dir)
-        await run('git', 'fetch', '--all', '--prune', cwd=repo_dir)
-        await run('git', 'reset', '--hard', f'origin/{git_branch}', cwd=repo_dir)
-
-    await run('git', 'log', '-1', '--oneline', cwd=repo_dir)
+    lock = _repo_locks.get(repo_dir)
+    if lock is None:
+        lock = _repo_locks[repo_dir] = asyncio.Lock()
+
+    # a webhook may arrive while the same repo is still syncing
+    async with lock:
+        jobs = str(git_jobs)
+
+        env = git_auth_env(git_url, git_token)
+
+        git = ('git', '-C', repo_dir)
+        depth = ('--depth', str(git_depth)) if git_depth else ()
+        partial = (f'--filter={git_filter}',) if git_filter else ()
+
+        if not os.path.isdir(f'{repo_dir}/.git'):
+            logging.info(f'Cloning {git_url} to {repo_dir}')
+            Path(repo_dir).mkdir(parents=True, exist_ok=True)
+            await run('git', 'clone', '--branch', git_branch, '--single-branch', '--no-tags', *depth, *partial,
+                      '--recurse-submodules', '--jobs', jobs, git_url, repo_dir, env=env)
+        else:
+            # a webhook for another branch, or a repeated delivery, leaves the
+            # branch where it was, and a probe is far cheaper than a fetch
+            remote, local = await asyncio.gather(
+                run(*git, 'ls-remote', git_url, f'refs/heads/{git_branch}', capture_output=True, env=env),
+                run(*git, 'rev-parse', 'HEAD', capture_output=True))
+            remote_head = remote.split(maxsplit=1)[0] if remote else None
+            if remote_head and remote_head == local.strip():
+                logger.info(f'{repo_dir} is already at {remote_head.decode()}')
+                return
+
+            logging.info(f'Pulling {git_url} to {repo_dir}')
+            # fetch the one branch straight from the URL into origin's
+            # tracking ref, so the stored origin URL never needs updating
+            refspec = f'+refs/heads/{git_branch}:refs/remotes/origin/{git_branch}'
+            await run(*git, 'fetch', '--prune', '--no-tags', *depth, '--jobs', jobs, git_url, refspec, env=env)
+            # a partial clone may need to fetch missing blobs to check out
+            await run(*git, 'reset', '--hard', '--recurse-submodules', f'origin/{git_branch}', env=env)
+
+        head = await run(*git, 'log', '-1', '--oneline', capture_output=True)
+        logger.info(f'{repo_dir} is at {head.decode(errors="replace").strip()}')
 
 
 # The end.
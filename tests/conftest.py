@@ -69,7 +69,7 @@ def mock_env_vars(monkeypatch):
     """
 
     env_vars_to_clear = [
-        'CONFIG_PATH',
+        'GITSYNC_CONFIG_PATH',
         'GITSYNC_GITHUB_APP_ID',
         'GITSYNC_GITHUB_INSTALLATION_ID',
         'GITSYNC_GITHUB_KEYFILE',
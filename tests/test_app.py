@@ -6,6 +6,7 @@ Unit tests for FastAPI application.
 :ai-assistant: Auto via Cursor
 """
 
+import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -15,10 +16,12 @@ from preoccupied.gitsync import app
 from preoccupied.gitsync.config import RootConfig, RepoConfig, GlobalConfig
 
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def client():
     """
-    Create a test client for the FastAPI app.
+    Create a test client for the FastAPI app, shared by the tests in this
+    module. Tests patch get_config themselves, so nothing in the
+    client itself carries over between them.
     """
 
     return TestClient(app)
@@ -160,7 +163,6 @@ class TestStartupEvent:
     Tests for the startup event handler.
     """
 
-    @pytest.mark.asyncio
     async def test_startup_syncs_all_repos(self, mock_config):
         """
         Test that startup event syncs all repositories.
@@ -190,11 +192,11 @@ class TestStartupEvent:
              patch('preoccupied.gitsync.config.RepoConfig.sync', new_callable=AsyncMock) as mock_sync:
 
             from preoccupied.gitsync.app import app_startup
-            await app_startup()
+            startup = await app_startup()
+            await startup
 
         assert mock_sync.call_count == 2
 
-    @pytest.mark.asyncio
     async def test_startup_handles_sync_failure_gracefully(self, mock_config):
         """
         Test that startup continues even if one repo sync fails.
@@ -232,11 +234,69 @@ class TestStartupEvent:
              patch('preoccupied.gitsync.config.RepoConfig.sync', new_callable=AsyncMock, side_effect=side_effect) as mock_sync:
 
             from preoccupied.gitsync.app import app_startup
-            await app_startup()
+            startup = await app_startup()
+            await startup
 
         assert mock_sync.call_count == 2
 
-    @pytest.mark.asyncio
+    async def test_startup_limits_parallel_syncs(self):
+        """
+        Test that startup syncs run concurrently, bounded by max_parallel_syncs.
+        """
+
+        repos = {
+            f'repo{i}': RepoConfig(
+                name=f'repo{i}',
+                directory=f'/tmp/repo{i}',
+                git_url=f'https://github.com/test/repo{i}.git'
+            )
+            for i in range(5)
+        }
+
+        config = RootConfig(
+            global_=GlobalConfig(max_parallel_syncs=2),
+            repos=repos
+        )
+
+        running = 0
+        peak = 0
+        async def side_effect(*args, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        with patch('preoccupied.gitsync.app.get_config', return_value=config), \
+             patch('preoccupied.gitsync.app.logger'), \
+             patch('preoccupied.gitsync.config.RepoConfig.sync', new_callable=AsyncMock, side_effect=side_effect) as mock_sync:
+
+            from preoccupied.gitsync.app import app_startup
+            startup = await app_startup()
+            await startup
+
+        assert mock_sync.call_count == 5
+        assert peak == 2
+
+    async def test_startup_sync_disabled(self, mock_config):
+        """
+        Test that no startup sync is started when sync_on_startup is disabled.
+        """
+
+        config = RootConfig(
+            global_=GlobalConfig(sync_on_startup=False),
+            repos=mock_config.repos
+        )
+
+        with patch('preoccupied.gitsync.app.get_config', return_value=config), \
+             patch('preoccupied.gitsync.config.RepoConfig.sync', new_callable=AsyncMock) as mock_sync:
+
+            from preoccupied.gitsync.app import app_startup
+            startup = await app_startup()
+
+        assert startup is None
+        mock_sync.assert_not_called()
+
     async def test_startup_raises_on_config_load_failure(self):
         """
         Test that startup raises exception if config loading fails.
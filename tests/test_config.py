@@ -8,14 +8,16 @@ Unit tests for configuration module.
 
 import os
 import tempfile
+from subprocess import CalledProcessError
 import yaml
-from unittest.mock import AsyncMock, patch, mock_open
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from pydantic import ValidationError
 
 from preoccupied.gitsync.config import (
     GlobalConfig, RepoConfig, GitHubRepoConfig, RootConfig,
-    get_config, _config_from_env
+    get_config, get_repo_config, _config_from_env
 )
 
 
@@ -51,6 +53,19 @@ class TestGlobalConfig:
         assert config.github_keyfile == '/path/to/key.pem'
         assert config.webhook_secret == 'secret123'
 
+    def test_global_config_frozen(self):
+        """
+        Test that GlobalConfig and RootConfig instances are immutable.
+        """
+
+        config = RootConfig(global_=GlobalConfig())
+
+        with pytest.raises(ValidationError):
+            config.global_.webhook_secret = 'secret123'
+
+        with pytest.raises(ValidationError):
+            config.repos = {}
+
 
 class TestRepoConfig:
     """
@@ -73,7 +88,22 @@ class TestRepoConfig:
         assert config.branch == 'master'
         assert config.provider == 'git'
 
-    @pytest.mark.asyncio
+    def test_repo_config_frozen(self):
+        """
+        Test that RepoConfig instances are immutable and hashable.
+        """
+
+        config = RepoConfig(
+            name='test-repo',
+            directory='/tmp/repo',
+            git_url='https://github.com/test/repo.git'
+        )
+
+        with pytest.raises(ValidationError):
+            config.branch = 'main'
+
+        assert hash(config) == hash(config.model_copy())
+
     async def test_repo_config_sync(self):
         """
         Test RepoConfig.sync() calls sync_git_repo with correct parameters.
@@ -83,7 +113,8 @@ class TestRepoConfig:
             name='test-repo',
             directory='/tmp/repo',
             git_url='https://github.com/test/repo.git',
-            branch='main'
+            branch='main',
+            git_jobs=4
         )
 
         with patch('preoccupied.gitsync.config.sync_git_repo', new_callable=AsyncMock) as mock_sync:
@@ -92,9 +123,31 @@ class TestRepoConfig:
         mock_sync.assert_called_once_with(
             repo_dir='/tmp/repo',
             git_url='https://github.com/test/repo.git',
-            git_branch='main'
+            git_branch='main',
+            git_jobs=4,
+            git_depth=1,
+            git_filter=None
+        )
+
+
+    async def test_repo_config_sync_full_history(self):
+        """
+        Test that a non-shallow RepoConfig syncs without a depth limit.
+        """
+
+        config = RepoConfig(
+            name='test-repo',
+            directory='/tmp/repo',
+            git_url='https://github.com/test/repo.git',
+            shallow=False,
+            depth=5
         )
 
+        with patch('preoccupied.gitsync.config.sync_git_repo', new_callable=AsyncMock) as mock_sync:
+            await config.sync()
+
+        assert mock_sync.call_args.kwargs['git_depth'] is None
+
 
 class TestGitHubRepoConfig:
     """
@@ -121,7 +174,6 @@ class TestGitHubRepoConfig:
         assert config.github_installation_id == '67890'
         assert config.github_keyfile == '/path/to/key.pem'
 
-    @pytest.mark.asyncio
     async def test_github_installation_token_without_keyfile(self):
         """
         Test github_installation_token returns None when keyfile is not set.
@@ -139,7 +191,6 @@ class TestGitHubRepoConfig:
         token = await config.github_installation_token()
         assert token is None
 
-    @pytest.mark.asyncio
     async def test_github_installation_token_with_keyfile(self):
         """
         Test github_installation_token calls github_installation_token function.
@@ -166,7 +217,38 @@ class TestGitHubRepoConfig:
             github_installation_id='67890'
         )
 
-    @pytest.mark.asyncio
+    def test_pick_installation_id_from_pool(self):
+        """
+        Test that repos without an installation ID pick a stable one from the pool.
+        """
+
+        config_data = {
+            'global': {
+                'github_app_id': '12345',
+                'github_installation_ids': ['111', '222', '333'],
+                'github_keyfile': '/path/to/key.pem'
+            },
+            'repos': {
+                f'repo{i}': {
+                    'directory': f'/tmp/repo{i}',
+                    'git_url': f'https://github.com/test/repo{i}.git',
+                    'provider': 'github'
+                }
+                for i in range(10)
+            }
+        }
+        config_data['repos']['repo0']['github_installation_id'] = '999'
+
+        config = RootConfig.model_validate(config_data)
+        picked = {name: repo.pick_installation_id() for name, repo in config.repos.items()}
+
+        assert picked['repo0'] == '999'
+        assert set(picked.values()) - {'999'} <= {'111', '222', '333'}
+        assert len(set(picked.values())) > 2
+
+        again = RootConfig.model_validate(config_data)
+        assert picked == {name: repo.pick_installation_id() for name, repo in again.repos.items()}
+
     async def test_github_repo_config_sync_with_token(self):
         """
         Test GitHubRepoConfig.sync() includes token in sync call.
@@ -178,7 +260,8 @@ class TestGitHubRepoConfig:
             git_url='https://github.com/test/repo.git',
             branch='main',
             provider='github',
-            github_keyfile='/path/to/key.pem'
+            github_keyfile='/path/to/key.pem',
+            git_jobs=2
         )
 
         with patch('preoccupied.gitsync.config.github_installation_token', new_callable=AsyncMock, return_value='token123'), \
@@ -190,10 +273,51 @@ class TestGitHubRepoConfig:
             repo_dir='/tmp/github-repo',
             git_url='https://github.com/test/repo.git',
             git_branch='main',
+            git_jobs=2,
+            git_depth=1,
+            git_filter=None,
             git_token='token123'
         )
 
 
+    @pytest.mark.parametrize('stderr, invalidated', [
+        (b"fatal: Authentication failed for 'https://github.com/test/repo.git/'\n", True),
+        (b"fatal: could not read Username for 'https://github.com': terminal prompts disabled\n", True),
+        (b'fatal: unable to access: The requested URL returned error: 403\n', True),
+        (b"fatal: couldn't find remote ref refs/heads/main\n", False),
+        (b"fatal: unable to access: Could not resolve host: github.com\n", False),
+        (None, False),
+    ])
+    async def test_github_repo_config_sync_failure_invalidates_token(self, stderr, invalidated):
+        """
+        Test that a sync refused for its credentials discards the token it
+        used, while other failures keep it.
+        """
+
+        config = GitHubRepoConfig(
+            name='github-repo',
+            directory='/tmp/github-repo',
+            git_url='https://github.com/test/repo.git',
+            provider='github',
+            github_app_id='12345',
+            github_installation_id='67890',
+            github_keyfile='/path/to/key.pem'
+        )
+
+        with patch('preoccupied.gitsync.config.github_installation_token', new_callable=AsyncMock, return_value='token123'), \
+             patch('preoccupied.gitsync.config.sync_git_repo', new_callable=AsyncMock,
+                   side_effect=CalledProcessError(128, ('git', 'fetch'), stderr=stderr)), \
+             patch('preoccupied.gitsync.config.invalidate_token') as mock_invalidate:
+
+            with pytest.raises(CalledProcessError):
+                await config.sync()
+
+        if invalidated:
+            mock_invalidate.assert_called_once_with('12345', '67890')
+        else:
+            mock_invalidate.assert_not_called()
+
+
 class TestRootConfig:
     """
     Tests for RootConfig model.
@@ -269,6 +393,32 @@ class TestRootConfig:
         config = RootConfig.model_validate(config_data)
         assert config.repos['repo1'].webhook_secret == 'repo-secret'
 
+    def test_root_config_git_jobs_default(self):
+        """
+        Test that the global git_jobs applies to repos that don't set their own.
+        """
+
+        config_data = {
+            'global': {
+                'git_jobs': 3
+            },
+            'repos': {
+                'repo1': {
+                    'directory': '/tmp/repo1',
+                    'git_url': 'https://github.com/test/repo1.git'
+                },
+                'repo2': {
+                    'directory': '/tmp/repo2',
+                    'git_url': 'https://github.com/test/repo2.git',
+                    'git_jobs': 1
+                }
+            }
+        }
+
+        config = RootConfig.model_validate(config_data)
+        assert config.repos['repo1'].git_jobs == 3
+        assert config.repos['repo2'].git_jobs == 1
+
 
 class TestConfigFromEnv:
     """
@@ -328,6 +478,21 @@ class TestConfigFromEnv:
         assert 'default' in config['repos']
         assert config['repos']['default']['name'] == 'default'
 
+    def test_config_from_env_warns_unknown(self, mock_env_vars, caplog):
+        """
+        Test that unrecognized GITSYNC_* variables are warned about and ignored.
+        """
+
+        mock_env_vars.setenv('GITSYNC_WEBHOOK_SECRT', 'typo')
+        mock_env_vars.setenv('GITSYNC_TOKEN_CACHE_DIR', '/tmp')
+
+        with caplog.at_level('WARNING', logger='preoccupied.gitsync.config'):
+            config = _config_from_env()
+
+        assert config == {'global': {}}
+        assert 'GITSYNC_WEBHOOK_SECRT' in caplog.text
+        assert 'GITSYNC_TOKEN_CACHE_DIR' not in caplog.text
+
 
 class TestGetConfig:
     """
@@ -346,7 +511,7 @@ class TestGetConfig:
         import preoccupied.gitsync.config as config_module
         config_module._config = None
 
-        with patch('preoccupied.gitsync.config.os.path.exists', return_value=False):
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', None):
 
             config = get_config()
             assert 'env-repo' in config.repos
@@ -372,13 +537,11 @@ class TestGetConfig:
         with open(config_file, 'w') as f:
             yaml.dump(config_data, f)
 
-        mock_env_vars.setenv('CONFIG_PATH', config_file)
 
         import preoccupied.gitsync.config as config_module
         config_module._config = None
 
-        with patch('preoccupied.gitsync.config.os.path.exists', return_value=True), \
-             patch('builtins.open', mock_open(read_data=yaml.dump(config_data))):
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
 
             config = get_config()
             assert 'file-repo' in config.repos
@@ -397,14 +560,15 @@ class TestGetConfig:
             'repos': {}
         }
 
-        mock_env_vars.setenv('CONFIG_PATH', config_file)
+        with open(config_file, 'w') as f:
+            yaml.dump(config_data, f)
+
         mock_env_vars.setenv('GITSYNC_WEBHOOK_SECRET', 'env-secret')
 
         import preoccupied.gitsync.config as config_module
         config_module._config = None
 
-        with patch('preoccupied.gitsync.config.os.path.exists', return_value=True), \
-             patch('builtins.open', mock_open(read_data=yaml.dump(config_data))):
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
 
             config = get_config()
             assert config.global_.webhook_secret == 'env-secret'
@@ -417,12 +581,263 @@ class TestGetConfig:
         import preoccupied.gitsync.config as config_module
         config_module._config = None
 
-        with patch('preoccupied.gitsync.config.os.path.exists', return_value=False):
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', None):
 
             config1 = get_config()
             config2 = get_config()
 
             assert config1 is config2
 
+    def test_get_config_reloads_when_file_changes(self, mock_env_vars, temp_dir):
+        """
+        Test that get_config re-reads the config file when its mtime changes.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        config_data = {
+            'repos': {
+                'first-repo': {
+                    'directory': '/tmp/first-repo',
+                    'git_url': 'https://github.com/test/first-repo.git'
+                }
+            }
+        }
+
+        with open(config_file, 'w') as f:
+            yaml.dump(config_data, f)
+        os.utime(config_file, (1000, 1000))
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            config1 = get_config()
+            assert get_config() is config1
+            assert 'first-repo' in config1.repos
+
+            config_data['repos']['second-repo'] = {
+                'directory': '/tmp/second-repo',
+                'git_url': 'https://github.com/test/second-repo.git'
+            }
+            with open(config_file, 'w') as f:
+                yaml.dump(config_data, f)
+            os.utime(config_file, (2000, 2000))
+
+            config2 = get_config()
+            assert config2 is not config1
+            assert 'second-repo' in config2.repos
+
+    def test_get_config_keeps_previous_config_on_reload_failure(self, mock_env_vars, temp_dir):
+        """
+        Test that a config file that breaks after the initial load doesn't
+        replace the last good config.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        config_data = {
+            'repos': {
+                'good-repo': {
+                    'directory': '/tmp/good-repo',
+                    'git_url': 'https://github.com/test/good-repo.git'
+                }
+            }
+        }
+
+        with open(config_file, 'w') as f:
+            yaml.dump(config_data, f)
+        os.utime(config_file, (1000, 1000))
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            config1 = get_config()
+
+            # an invalid config
+            with open(config_file, 'w') as f:
+                yaml.dump({'repos': {'bad-repo': {'directory': '/tmp/bad-repo'}}}, f)
+            os.utime(config_file, (2000, 2000))
+            assert get_config() is config1
+            assert 'good-repo' in get_config().repos
+
+    def test_get_config_empty_file(self, mock_env_vars, temp_dir):
+        """
+        Test that an empty config file loads as an empty config.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            pass
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+            config = get_config()
+
+        assert config.repos == {}
+
+    def test_get_config_uses_json_cache(self, mock_env_vars, temp_dir):
+        """
+        Test that get_config writes a JSON sidecar cache and loads from it
+        while the config file is unchanged.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        config_data = {
+            'global': {
+                'webhook_secret': 'file-secret'
+            },
+            'repos': {
+                'file-repo': {
+                    'directory': '/tmp/file-repo',
+                    'git_url': 'https://github.com/test/file-repo.git'
+                }
+            }
+        }
+
+        with open(config_file, 'w') as f:
+            yaml.dump(config_data, f)
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            config1 = get_config()
+            assert os.path.exists(config_file + '.cache.json')
+            assert os.stat(config_file + '.cache.json').st_mode & 0o077 == 0
+
+            config_module._config = None
+            with patch('preoccupied.gitsync.config.yaml.load') as mock_load:
+                config2 = get_config()
+
+            mock_load.assert_not_called()
+            assert config2 == config1
+            assert config2.repos['file-repo'].webhook_secret == 'file-secret'
+
+    def test_get_config_json_cache_with_env_repo(self, mock_env_vars, temp_dir):
+        """
+        Test that the JSON sidecar cache is still used when a repo is also
+        configured from the environment.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            yaml.dump({'repos': {}}, f)
+
+        mock_env_vars.setenv('GITSYNC_REPO_DIRECTORY', '/tmp/env-repo')
+        mock_env_vars.setenv('GITSYNC_REPO_GIT_URL', 'https://github.com/test/env-repo.git')
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            config1 = get_config()
+
+            config_module._config = None
+            with patch('preoccupied.gitsync.config.yaml.load') as mock_load:
+                config2 = get_config()
+
+            mock_load.assert_not_called()
+            assert config2 == config1
+            assert 'default' in config2.repos
+
+    def test_get_config_json_cache_ignored_when_contents_change(self, mock_env_vars, temp_dir):
+        """
+        Test that the JSON sidecar cache is not used when the config file
+        contents changed, even if its mtime was preserved.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            yaml.dump({'global': {'webhook_secret': 'old-secret'}}, f)
+        os.utime(config_file, (1000, 1000))
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            assert get_config().global_.webhook_secret == 'old-secret'
+
+            with open(config_file, 'w') as f:
+                yaml.dump({'global': {'webhook_secret': 'new-secret'}}, f)
+            os.utime(config_file, (1000, 1000))
+
+            config_module._config = None
+            assert get_config().global_.webhook_secret == 'new-secret'
+
+    def test_get_config_json_cache_not_an_object(self, mock_env_vars, temp_dir):
+        """
+        Test that a JSON sidecar cache which isn't an object is ignored.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            yaml.dump({'global': {'webhook_secret': 'file-secret'}}, f)
+        with open(config_file + '.cache.json', 'w') as f:
+            f.write('[1, 2]')
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+            config = get_config()
+
+        assert config.global_.webhook_secret == 'file-secret'
+
+    def test_get_config_json_cache_ignored_when_env_changes(self, mock_env_vars, temp_dir):
+        """
+        Test that the JSON sidecar cache is not used when the environment
+        overrides differ from those it was written with.
+        """
+
+        config_file = os.path.join(temp_dir, 'config.yaml')
+        config_data = {
+            'global': {
+                'webhook_secret': 'file-secret'
+            },
+            'repos': {}
+        }
+
+        with open(config_file, 'w') as f:
+            yaml.dump(config_data, f)
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', config_file):
+
+            config1 = get_config()
+            assert config1.global_.webhook_secret == 'file-secret'
+
+            mock_env_vars.setenv('GITSYNC_WEBHOOK_SECRET', 'env-secret')
+            config_module._config = None
+
+            config2 = get_config()
+            assert config2.global_.webhook_secret == 'env-secret'
+
+    def test_get_repo_config(self, mock_env_vars):
+        """
+        Test get_repo_config looks up repos from the current config.
+        """
+
+        mock_env_vars.setenv('GITSYNC_REPO_NAME', 'env-repo')
+        mock_env_vars.setenv('GITSYNC_REPO_DIRECTORY', '/tmp/env-repo')
+        mock_env_vars.setenv('GITSYNC_REPO_GIT_URL', 'https://github.com/test/env-repo.git')
+
+        import preoccupied.gitsync.config as config_module
+        config_module._config = None
+
+        with patch('preoccupied.gitsync.config.CONFIG_PATH', None):
+
+            repo = get_repo_config('env-repo')
+            assert repo is get_config().repos['env-repo']
+            assert get_repo_config('missing') is None
+
 
 # The end.
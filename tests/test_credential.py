@@ -0,0 +1,131 @@
+"""
+Unit tests for the git credential helper.
+
+:author: Christopher O'Brien <obriencj@preoccupied.net>
+:license: GNU General Public License v3
+:ai-assistant: Auto via Cursor
+"""
+
+import io
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from preoccupied.gitsync import credential
+
+
+class TestCredentialHelper:
+    """
+    Tests for the gitsync-credential-helper entry point.
+    """
+
+    def test_read_request(self):
+        """
+        Test that a request is read up to the blank line.
+        """
+
+        stream = io.StringIO('protocol=https\nhost=github.com\n\nignored=1\n')
+        assert credential.read_request(stream) == {'protocol': 'https', 'host': 'github.com'}
+
+    def test_get_prints_token(self, monkeypatch, capsys):
+        """
+        Test that 'get' answers with the installation token.
+        """
+
+        monkeypatch.setenv('GITSYNC_GITHUB_APP_ID', '123')
+        monkeypatch.setenv('GITSYNC_GITHUB_INSTALLATION_ID', '456')
+        monkeypatch.setenv('GITSYNC_GITHUB_KEYFILE', '/path/to/key.pem')
+        monkeypatch.delenv('GITSYNC_GITHUB_HOST', raising=False)
+        monkeypatch.setattr('sys.stdin', io.StringIO('protocol=https\nhost=github.com\n\n'))
+
+        with patch('preoccupied.gitsync.credential.github_installation_token',
+                   new_callable=AsyncMock, return_value='tok') as mock_token:
+            assert credential.main(['get']) == 0
+
+        mock_token.assert_called_once_with(
+            github_keyfile='/path/to/key.pem',
+            github_app_id='123',
+            github_installation_id='456',
+        )
+        assert capsys.readouterr().out == 'username=x-access-token\npassword=tok\n\n'
+
+    def test_get_other_host(self, monkeypatch, capsys):
+        """
+        Test that hosts other than GitHub are given no credentials.
+        """
+
+        monkeypatch.delenv('GITSYNC_GITHUB_HOST', raising=False)
+        monkeypatch.setattr('sys.stdin', io.StringIO('protocol=https\nhost=example.com\n\n'))
+
+        with patch('preoccupied.gitsync.credential.github_installation_token',
+                   new_callable=AsyncMock) as mock_token:
+            assert credential.main(['get']) == 0
+
+        mock_token.assert_not_called()
+        assert capsys.readouterr().out == ''
+
+    def test_get_configured_host(self, monkeypatch, capsys):
+        """
+        Test that GITSYNC_GITHUB_HOST replaces github.com as the host.
+        """
+
+        monkeypatch.setenv('GITSYNC_GITHUB_HOST', 'github.example.com')
+        monkeypatch.setattr('sys.stdin', io.StringIO('protocol=https\nhost=github.example.com\n\n'))
+
+        with patch('preoccupied.gitsync.credential.github_installation_token',
+                   new_callable=AsyncMock, return_value='tok'):
+            assert credential.main(['get']) == 0
+
+        assert capsys.readouterr().out == 'username=x-access-token\npassword=tok\n\n'
+
+    def test_store_is_ignored(self, monkeypatch, capsys):
+        """
+        Test that 'store' produces no output and caches nothing.
+        """
+
+        monkeypatch.setattr('sys.stdin', io.StringIO('protocol=https\nhost=github.com\n\n'))
+
+        with patch('preoccupied.gitsync.credential.invalidate_token') as mock_invalidate:
+            assert credential.main(['store']) == 0
+
+        mock_invalidate.assert_not_called()
+        assert capsys.readouterr().out == ''
+
+    @pytest.mark.parametrize('host, invalidated', [
+        ('github.com', True),
+        ('example.com', False),
+    ])
+    def test_erase_invalidates_token(self, monkeypatch, capsys, host, invalidated):
+        """
+        Test that 'erase' for the GitHub host discards the cached token.
+        """
+
+        monkeypatch.setenv('GITSYNC_GITHUB_APP_ID', '123')
+        monkeypatch.setenv('GITSYNC_GITHUB_INSTALLATION_ID', '456')
+        monkeypatch.delenv('GITSYNC_GITHUB_HOST', raising=False)
+        monkeypatch.setattr('sys.stdin', io.StringIO(f'protocol=https\nhost={host}\npassword=tok\n\n'))
+
+        with patch('preoccupied.gitsync.credential.invalidate_token') as mock_invalidate:
+            assert credential.main(['erase']) == 0
+
+        if invalidated:
+            mock_invalidate.assert_called_once_with('123', '456')
+        else:
+            mock_invalidate.assert_not_called()
+        assert capsys.readouterr().out == ''
+
+    def test_get_failure(self, monkeypatch, capsys):
+        """
+        Test that a token failure exits non-zero without credentials.
+        """
+
+        monkeypatch.delenv('GITSYNC_GITHUB_KEYFILE', raising=False)
+        monkeypatch.setattr('sys.stdin', io.StringIO('protocol=https\nhost=github.com\n\n'))
+
+        assert credential.main(['get']) == 1
+        captured = capsys.readouterr()
+        assert captured.out == ''
+        assert 'must be set' in captured.err
+
+
+# The end.